@@ -9,15 +9,24 @@ sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='repla
 sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8', errors='replace')
 
 import asyncio
+import json
+import math
 import time
+import openpyxl
 import pandas as pd
 from pathlib import Path
 from datetime import datetime
-from tqdm.asyncio import tqdm_asyncio
+from tqdm import tqdm
+
+try:
+    import polars as pl  # 可选依赖，安装后使用更快的读取方式
+except ImportError:
+    pl = None
 
 import config
 from gemini_service import get_gemini_service
-from preprocessor import normalize_separator
+from local_parser import try_parse
+from preprocessor import normalize_parallel, normalize_series
 
 
 # ============ 配置区域 ============
@@ -27,6 +36,55 @@ MAX_ROWS = None  # 最多处理行数（设为 None 处理全部）
 # =================================
 
 
+def read_column(file_path, col_index: int) -> list:
+    """读取第一个工作表中指定列的非空单元格，返回字符串列表"""
+    if config.USE_POLARS and pl is not None:
+        try:
+            column = pl.read_excel(file_path, has_header=False, columns=[col_index]).to_series(0)
+            return column.cast(pl.Utf8).drop_nulls().to_list()
+        except ImportError:
+            # polars 读取 Excel 还依赖 fastexcel，未安装时回退到 openpyxl
+            pass
+    
+    # 未启用或无法使用 polars 时以只读流式模式读取
+    wb = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        ws = wb.worksheets[0]
+        col = col_index + 1
+        return [
+            str(value)
+            for (value,) in ws.iter_rows(min_col=col, max_col=col, values_only=True)
+            if value is not None
+        ]
+    finally:
+        wb.close()
+
+
+def write_rows(file_path, columns: list, rows) -> None:
+    """以只写模式流式写出 Excel，不在内存中构建完整的单元格对象"""
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet()
+    ws.append(columns)
+    for row in rows:
+        ws.append(row)
+    wb.save(file_path)
+
+
+def split_batches(items: list, batch_size: int) -> list:
+    """按 batch_size 确定批次数后均分为连续批次，各批大小最多相差 1，避免末尾出现过小的批次"""
+    if not items:
+        return []
+    n_batches = math.ceil(len(items) / batch_size)
+    size, extra = divmod(len(items), n_batches)
+    batches = []
+    start = 0
+    for i in range(n_batches):
+        end = start + size + (1 if i < extra else 0)
+        batches.append(items[start:end])
+        start = end
+    return batches
+
+
 async def process_batch(gemini_service, batch: list, batch_index: int) -> tuple:
     """处理单个批次，返回 (batch_index, batch, results)"""
     try:
@@ -43,43 +101,66 @@ async def main():
     print("=" * 50)
     print("账户数据批量清洗工具")
     print("=" * 50)
-    print(f"\n⚙️  配置: 并发数={config.MAX_CONCURRENT_REQUESTS}, 批次大小={config.BATCH_SIZE}, 模型={config.GEMINI_MODEL}")
+    print(f"\n⚙️  配置: RPM={config.RPM_LIMIT}, 并发数={config.MAX_CONCURRENT_REQUESTS}, 批次大小={config.BATCH_SIZE}, 模型={config.GEMINI_MODEL}")
     
     # 1. 读取 Excel 文件
     print(f"\n📂 读取文件: {INPUT_FILE}")
-    df = pd.read_excel(INPUT_FILE, header=None)
-    
-    # 获取 A 列数据（第 0 列）
+    # 只读取账户所在列（A列 = 第 0 列）
     col_index = ord(INPUT_COLUMN.upper()) - ord('A')
-    accounts = df.iloc[:, col_index].dropna().astype(str).tolist()
+    accounts = pd.Series(read_column(INPUT_FILE, col_index), dtype=str)
     
     # 跳过表头行（如果第一行看起来是表头）
-    if accounts and accounts[0] in ["账户", "账户名", "原始账户", "account"]:
-        print(f"⚠️  检测到表头行 '{accounts[0]}'，已跳过")
-        accounts = accounts[1:]
+    if len(accounts) and accounts.iloc[0] in ["账户", "账户名", "原始账户", "account"]:
+        print(f"⚠️  检测到表头行 '{accounts.iloc[0]}'，已跳过")
+        accounts = accounts.iloc[1:]
     
     # 过滤掉明显不是账户数据的行（太短或不包含分隔符）
     original_count = len(accounts)
-    accounts = [acc for acc in accounts if len(acc) > 5 and ("-" in acc or "_" in acc)]
+    mask = (accounts.str.len() > 5) & accounts.str.contains(r"[-_]", regex=True, na=False)
+    accounts = accounts[mask]
     if len(accounts) < original_count:
         print(f"⚠️  过滤掉 {original_count - len(accounts)} 条无效数据")
     
     # 限制行数
     if MAX_ROWS:
-        accounts = accounts[:MAX_ROWS]
+        accounts = accounts.iloc[:MAX_ROWS]
     
     print(f"📊 共读取 {len(accounts)} 条账户数据")
     
     # 2. 预处理
     print("\n🔧 预处理中...")
-    accounts = [normalize_separator(acc) for acc in accounts]
+    if len(accounts) >= config.PARALLEL_PREPROCESS_THRESHOLD:
+        accounts = normalize_parallel(accounts)
+    else:
+        accounts = normalize_series(accounts).tolist()
+    
+    # 去重：相同账户只请求一次，输出时再按原顺序展开
+    unique_accounts = list(dict.fromkeys(accounts))
+    if len(unique_accounts) < len(accounts):
+        print(f"♻️  去除 {len(accounts) - len(unique_accounts)} 条重复数据，实际清洗 {len(unique_accounts)} 条")
+    
+    # 格式规整的账户直接按规则解析，其余交给 Gemini
+    result_by_account = {}
+    pending_accounts = unique_accounts
+    if config.ENABLE_LOCAL_PARSER:
+        for acc in unique_accounts:
+            result = try_parse(acc)
+            if result:
+                result_by_account[acc] = result
+        pending_accounts = [acc for acc in unique_accounts if acc not in result_by_account]
+        print(f"⚡ 本地规则解析 {len(result_by_account)} 条，剩余 {len(pending_accounts)} 条交给 Gemini")
+    
+    # 生成输出文件名（处理前确定，以便边处理边写入中间结果）
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    output_file = Path(INPUT_FILE).parent / f"清洗结果_{timestamp}.xlsx"
+    partial_file = output_file.with_suffix(".jsonl")
     
-    # 3. 调用 Gemini API 批量清洗（asyncio.gather 并发模式）
-    print(f"\n🚀 开始调用 Gemini API（批次大小: {config.BATCH_SIZE}，并发数: {config.MAX_CONCURRENT_REQUESTS}）")
+    # 3. 调用 Gemini API 批量清洗（asyncio.as_completed 并发模式）
+    print(f"\n🚀 开始调用 Gemini API（批次大小: {config.BATCH_SIZE}，RPM: {config.RPM_LIMIT}）")
     gemini_service = get_gemini_service()
     
     # 分批处理
-    batches = [accounts[i:i+config.BATCH_SIZE] for i in range(0, len(accounts), config.BATCH_SIZE)]
+    batches = split_batches(pending_accounts, config.BATCH_SIZE)
     print(f"📦 共 {len(batches)} 个批次")
     
     # 创建所有并发任务
@@ -88,56 +169,59 @@ async def main():
         for i, batch in enumerate(batches)
     ]
     
-    # 使用 asyncio.gather 并发执行，信号量在 gemini_service 中控制并发数
-    batch_results = await tqdm_asyncio.gather(*tasks, desc="处理进度")
-    
-    # 按原始顺序排序结果
-    batch_results = sorted(batch_results, key=lambda x: x[0])
-    
-    # 整理结果
-    all_results = []
-    failed_accounts = []
-    
+    # 使用 asyncio.as_completed 并发执行，请求速率和并发数在 gemini_service 中控制
+    # 每个批次完成后立即追加写入中间结果文件，中途崩溃也不会丢失已完成的结果
+    batch_results = [None] * len(batches)
+    try:
+        with open(partial_file, "w", encoding="utf-8") as f:
+            for coro in tqdm(asyncio.as_completed(tasks), total=len(tasks), desc="处理进度"):
+                batch_result = await coro
+                # 按批次序号写回，结果保持原始顺序
+                batch_index, batch, results, _ = batch_result
+                batch_results[batch_index] = batch_result
+                for acc, result in zip(batch, results or [None] * len(batch)):
+                    f.write(json.dumps({"原始账户名": acc, **(result or {})}, ensure_ascii=False) + "\n")
+                f.flush()
+    finally:
+        gemini_service.close()
+    
+    # 整理结果：先按账户汇总，再按原始顺序展开（重复账户共用同一结果）
     for batch_index, batch, results, error in batch_results:
         if error:
             print(f"\n❌ 批次 {batch_index + 1} 处理失败: {error}")
-            for acc in batch:
-                failed_accounts.append(acc)
-                all_results.append({"原始账户名": acc})
-        else:
-            for acc, result in zip(batch, results):
-                if result:
-                    result["原始账户名"] = acc
-                    all_results.append(result)
-                else:
-                    failed_accounts.append(acc)
-                    all_results.append({"原始账户名": acc})
+            results = [None] * len(batch)
+        result_by_account.update(zip(batch, results))
     
-    # 4. 输出到 Excel
-    print(f"\n✅ 处理完成！成功: {len(all_results) - len(failed_accounts)}, 失败: {len(failed_accounts)}")
+    # 直接按输出列顺序生成行，缺失字段写为空单元格
+    columns_order = ["原始账户名", "分销自产", "上剧日期", "名称", "盈利方式", "投流人", "类型", "主体"]
+    field_columns = columns_order[1:]
+    empty_fields = (None,) * len(field_columns)
     
-    # 创建 DataFrame
-    output_df = pd.DataFrame(all_results)
+    rows = []
+    failed_count = 0
     
-    # 调整列顺序
-    columns_order = ["原始账户名", "分销自产", "上剧日期", "名称", "盈利方式", "投流人", "类型", "主体"]
-    for col in columns_order:
-        if col not in output_df.columns:
-            output_df[col] = None
-    output_df = output_df[columns_order]
+    for acc in accounts:
+        result = result_by_account[acc]
+        if result:
+            rows.append((acc, *(result.get(col) for col in field_columns)))
+        else:
+            failed_count += 1
+            rows.append((acc, *empty_fields))
     
-    # 生成输出文件名
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    output_file = Path(INPUT_FILE).parent / f"清洗结果_{timestamp}.xlsx"
+    # 4. 输出到 Excel
+    print(f"\n✅ 处理完成！成功: {len(rows) - failed_count}, 失败: {failed_count}")
     
-    output_df.to_excel(output_file, index=False)
+    write_rows(output_file, columns_order, rows)
     print(f"\n📁 结果已保存到: {output_file}")
     
-    # 输出失败列表
-    if failed_accounts:
+    # Excel 写入成功后删除中间结果文件
+    partial_file.unlink()
+    
+    # 输出失败列表（写出时再从结果中筛选，不额外保存一份失败账户）
+    if failed_count:
         failed_file = Path(INPUT_FILE).parent / f"失败记录_{timestamp}.txt"
         with open(failed_file, "w", encoding="utf-8") as f:
-            f.write("\n".join(failed_accounts))
+            f.write("\n".join(acc for acc in accounts if not result_by_account[acc]))
         print(f"⚠️ 失败记录已保存到: {failed_file}")
     
     # 输出总耗时
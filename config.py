@@ -12,9 +12,33 @@ GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "")
 GEMINI_MODEL = "gemini-flash-lite-latest"
 
 # 并发配置
-MAX_CONCURRENT_REQUESTS = 20  # 最大并发请求数
+RPM_LIMIT = 1000              # 每分钟最大请求数（按账号的 API 配额设置）
+MAX_CONCURRENT_REQUESTS = 64  # 最大在途请求数（仅用于限制内存占用）
 BATCH_SIZE = 20               # 每批发送给 API 的数量
 
+# 连接配置
+ENABLE_HTTP2 = True           # 使用 HTTP/2 多路复用，并发请求共享少量连接
+MAX_KEEPALIVE_CONNECTIONS = 32  # 连接池保持的空闲连接数
+KEEPALIVE_EXPIRY = 60         # 空闲连接保持时间（秒）
+
+# 预处理配置
+# 账户数达到该值且为多核时使用多进程预处理；预处理完成后才开始调用 API，两者不会重叠
+PARALLEL_PREPROCESS_THRESHOLD = 1_000_000
+
+# 本地结果缓存配置
+ENABLE_RESULT_CACHE = True             # 是否缓存清洗结果，重复运行时跳过已清洗的账户
+RESULT_CACHE_FILE = ".gemini_cache"    # 缓存文件路径
+
+# 本地规则解析配置
+ENABLE_LOCAL_PARSER = True    # 格式规整的账户直接按规则解析，不调用 API
+
+# 读取配置
+USE_POLARS = True             # 已安装 polars 时用其读取 Excel（更快），否则使用 openpyxl
+
 # 重试配置
 MAX_RETRIES = 5               # 最大重试次数
 RETRY_DELAY = 2.0             # 重试间隔（秒）
+
+# 上下文缓存配置
+ENABLE_CONTEXT_CACHE = True   # 是否将系统提示词和少样本示例上传为缓存内容
+CONTEXT_CACHE_TTL = 3600      # 缓存有效期（秒），运行中过半时自动续期，结束时删除
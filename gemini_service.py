@@ -3,12 +3,23 @@ Gemini API 服务模块 - 异步调用 Gemini API 进行账户数据清洗
 """
 import json
 import asyncio
+import hashlib
+import shelve
+import time
 from typing import List, Optional
+import httpx
+from aiolimiter import AsyncLimiter
 from google import genai
-from google.genai import types
+from google.genai import errors, types
+from pydantic import BaseModel, TypeAdapter
 
 import config  # 直接导入根目录的 config
 
+try:
+    import orjson  # 可选依赖，安装后序列化更快
+except ImportError:
+    orjson = None
+
 
 # 少样本学习 Prompt 模板
 SYSTEM_PROMPT = """你是一个专业的数据清洗助手，专门处理短剧投流账户字段的结构化清洗。
@@ -81,15 +92,157 @@ FEW_SHOT_EXAMPLES = """
 """
 
 
+class AccountRecord(BaseModel):
+    """单条账户的结构化结果，用于生成约束模型输出的 JSON Schema"""
+    分销自产: str
+    上剧日期: str
+    名称: str
+    盈利方式: str
+    投流人: str
+    类型: str
+    主体: str
+
+
+# 响应的 JSON Schema 只生成一次；以 JSON Schema 形式传入时 SDK 直接解析为 dict 列表，
+# 不再为每个响应构造 pydantic 模型再转回 dict
+ACCOUNT_LIST_SCHEMA = TypeAdapter(list[AccountRecord]).json_schema()
+
+
+# 每次请求附带的任务指令
+TASK_INSTRUCTION = "现在请处理以下账户数据，只返回 JSON 数组，不要有其他内容："
+
+# 上下文缓存失效（过期或被删除）时返回的错误码
+CACHE_ERROR_CODES = {403, 404}
+
+# 可重试的客户端错误码：请求超时、触发限流；其余 4xx 错误重试也不会成功
+RETRYABLE_CLIENT_CODES = {408, 429}
+
+
+def _parse_retry_delay(error: Exception) -> Optional[float]:
+    """从 API 错误中解析服务端要求的重试等待秒数，没有时返回 None"""
+    if not isinstance(error, errors.APIError):
+        return None
+    
+    # 优先使用 Retry-After 响应头
+    headers = getattr(error.response, "headers", None)
+    retry_after = headers.get("retry-after") if headers else None
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+    
+    # Gemini 会在错误详情的 RetryInfo 中给出 retryDelay，如 "31s"
+    details = error.details if isinstance(error.details, dict) else {}
+    for item in details.get("error", details).get("details", None) or []:
+        if isinstance(item, dict) and item.get("@type", "").endswith("RetryInfo"):
+            try:
+                return float(str(item.get("retryDelay", "")).rstrip("s"))
+            except ValueError:
+                return None
+    return None
+
+
+def _dumps_accounts(accounts: List[str]) -> str:
+    """将账户列表序列化为紧凑的 JSON 字符串（保留中文原文）"""
+    if orjson is not None:
+        return orjson.dumps(accounts).decode("utf-8")
+    return json.dumps(accounts, ensure_ascii=False, separators=(",", ":"))
+
+
 class GeminiService:
     """Gemini API 异步服务"""
     
     def __init__(self):
-        self.client = genai.Client(api_key=config.GEMINI_API_KEY)
+        # 所有批次复用同一个 HTTP/2 连接池，避免频繁建立 TCP/TLS 连接
+        self.client = genai.Client(
+            api_key=config.GEMINI_API_KEY,
+            http_options=types.HttpOptions(
+                async_client_args={
+                    "http2": config.ENABLE_HTTP2,
+                    "limits": httpx.Limits(
+                        max_keepalive_connections=config.MAX_KEEPALIVE_CONNECTIONS,
+                        keepalive_expiry=config.KEEPALIVE_EXPIRY,
+                    ),
+                },
+            ),
+        )
         self.model = config.GEMINI_MODEL
+        # 按 API 的每分钟请求配额平滑发起请求，信号量只用于限制在途请求数
+        self.limiter = AsyncLimiter(config.RPM_LIMIT, 60)
         self.semaphore = asyncio.Semaphore(config.MAX_CONCURRENT_REQUESTS)
         self.max_retries = config.MAX_RETRIES
         self.retry_delay = config.RETRY_DELAY
+        # 系统提示词和少样本示例只上传一次，后续请求通过缓存名称引用
+        self.cached_content = self._create_cached_content() if config.ENABLE_CONTEXT_CACHE else None
+        # 运行时间超过有效期的一半时续期，避免长时间运行中途缓存过期
+        self._cache_refresh_at = time.monotonic() + config.CONTEXT_CACHE_TTL / 2
+        self._cache_lock = asyncio.Lock()
+        self._build_request_template()
+        # 本地结果缓存：重复运行时只请求新增或变化的账户
+        # 模型、提示词或输出 schema 变化后旧结果不再适用，将其摘要计入缓存键
+        prompt_version = "\n".join([
+            self.model,
+            SYSTEM_PROMPT,
+            FEW_SHOT_EXAMPLES,
+            TASK_INSTRUCTION,
+            json.dumps(ACCOUNT_LIST_SCHEMA, ensure_ascii=False, sort_keys=True),
+        ])
+        self._cache_salt = hashlib.sha1(prompt_version.encode("utf-8")).hexdigest()
+        self.result_cache = shelve.open(config.RESULT_CACHE_FILE) if config.ENABLE_RESULT_CACHE else None
+    
+    def _build_request_template(self):
+        """根据是否使用上下文缓存，构造每次请求共用的 Prompt 前缀和生成配置"""
+        # Prompt 中固定不变的前缀只拼接一次；提示词已在缓存中时只需发送任务指令
+        if self.cached_content:
+            self._prompt_prefix = f"{TASK_INSTRUCTION}\n"
+        else:
+            self._prompt_prefix = f"{SYSTEM_PROMPT}\n\n{FEW_SHOT_EXAMPLES}\n\n{TASK_INSTRUCTION}\n"
+        # 生成配置在每次请求间不变，只构造一次
+        self._generate_config = types.GenerateContentConfig(
+            cached_content=self.cached_content,
+            temperature=0.1,  # 低温度提高一致性
+            response_mime_type="application/json",
+            response_json_schema=ACCOUNT_LIST_SCHEMA,  # 结构化输出，保证返回合法 JSON
+        )
+    
+    def _use_inline_prompt(self):
+        """放弃上下文缓存，改为每次发送完整 Prompt"""
+        self.cached_content = None
+        self._build_request_template()
+    
+    async def _refresh_cached_content(self):
+        """上下文缓存临近过期时续期，续期失败则回退为完整 Prompt"""
+        if not self.cached_content or time.monotonic() < self._cache_refresh_at:
+            return
+        async with self._cache_lock:
+            if not self.cached_content or time.monotonic() < self._cache_refresh_at:
+                return
+            try:
+                await self.client.aio.caches.update(
+                    name=self.cached_content,
+                    config=types.UpdateCachedContentConfig(ttl=f"{config.CONTEXT_CACHE_TTL}s"),
+                )
+                self._cache_refresh_at = time.monotonic() + config.CONTEXT_CACHE_TTL / 2
+            except Exception as e:
+                print(f"⚠️  上下文缓存续期失败，改为每次发送完整 Prompt: {e}")
+                self._use_inline_prompt()
+    
+    def _create_cached_content(self) -> Optional[str]:
+        """创建上下文缓存，返回缓存名称；创建失败时返回 None，回退为每次发送完整 Prompt"""
+        try:
+            cached = self.client.caches.create(
+                model=self.model,
+                config=types.CreateCachedContentConfig(
+                    system_instruction=SYSTEM_PROMPT,
+                    contents=[FEW_SHOT_EXAMPLES],
+                    ttl=f"{config.CONTEXT_CACHE_TTL}s",
+                )
+            )
+            return cached.name
+        except Exception as e:
+            print(f"⚠️  上下文缓存创建失败，改为每次发送完整 Prompt: {e}")
+            return None
     
     async def clean_batch(self, accounts: List[str]) -> List[Optional[dict]]:
         """
@@ -101,54 +254,93 @@ class GeminiService:
         Returns:
             清洗结果列表，失败的返回 None
         """
+        if self.result_cache is None:
+            async with self.semaphore:
+                return await self._call_api_with_retry(accounts)
+        
+        keys = [self._cache_key(acc) for acc in accounts]
+        results = [self.result_cache.get(key) for key in keys]
+        missing = [i for i, result in enumerate(results) if result is None]
+        if not missing:
+            return results
+        
         async with self.semaphore:
-            return await self._call_api_with_retry(accounts)
+            fresh_results = await self._call_api_with_retry([accounts[i] for i in missing])
+        
+        for i, result in zip(missing, fresh_results):
+            results[i] = result
+            if result:
+                self.result_cache[keys[i]] = result
+        return results
+    
+    def _cache_key(self, account: str) -> str:
+        """结果缓存键：模型/提示词/schema 摘要 + 预处理后的账户字符串的 SHA1"""
+        return hashlib.sha1(f"{self._cache_salt}\n{account}".encode("utf-8")).hexdigest()
+    
+    def close(self):
+        """删除上下文缓存（避免继续计费），并关闭本地结果缓存确保写入磁盘"""
+        if self.cached_content:
+            try:
+                self.client.caches.delete(name=self.cached_content)
+            except Exception as e:
+                print(f"⚠️  上下文缓存删除失败: {e}")
+            self._use_inline_prompt()
+        if self.result_cache is not None:
+            self.result_cache.close()
+            self.result_cache = None
     
     async def _call_api_with_retry(self, accounts: List[str]) -> List[Optional[dict]]:
         """带重试的 API 调用"""
+        last_error = None
         for attempt in range(self.max_retries):
+            await self._refresh_cached_content()
+            used_cache = self.cached_content
             try:
-                return await self._call_api(accounts)
-            except Exception as e:
-                if attempt < self.max_retries - 1:
-                    await asyncio.sleep(self.retry_delay * (2 ** attempt))
-                else:
-                    print(f"API 调用失败: {e}")
+                # 每次尝试（包括重试）都计入速率配额
+                async with self.limiter:
+                    return await self._call_api(accounts)
+            except errors.ClientError as e:
+                if used_cache and e.code in CACHE_ERROR_CODES:
+                    # 上下文缓存已失效，改用完整 Prompt 后立即重试（并发批次只需回退一次）
+                    if self.cached_content == used_cache:
+                        print(f"⚠️  上下文缓存不可用，改为每次发送完整 Prompt: {e}")
+                        self._use_inline_prompt()
+                    last_error = e
+                    continue
+                if e.code not in RETRYABLE_CLIENT_CODES:
+                    # 参数错误、鉴权失败等，直接放弃
+                    print(f"API 调用失败（不可重试）: {e}")
                     return [None] * len(accounts)
+                last_error = e
+            except Exception as e:
+                last_error = e
+            
+            if attempt < self.max_retries - 1:
+                # 服务端给出了等待时间就按其等待，否则指数退避
+                delay = _parse_retry_delay(last_error)
+                if delay is None:
+                    delay = self.retry_delay * (2 ** attempt)
+                await asyncio.sleep(delay)
+        
+        print(f"API 调用失败: {last_error}")
         return [None] * len(accounts)
     
     async def _call_api(self, accounts: List[str]) -> List[Optional[dict]]:
         """调用 Gemini API"""
-        prompt = f"""{SYSTEM_PROMPT}
-
-{FEW_SHOT_EXAMPLES}
-
-现在请处理以下账户数据，只返回 JSON 数组，不要有其他内容：
-{json.dumps(accounts, ensure_ascii=False)}
-"""
+        prompt = self._prompt_prefix + _dumps_accounts(accounts)
         
         # 使用异步生成内容
         response = await self.client.aio.models.generate_content(
             model=self.model,
             contents=prompt,
-            config=types.GenerateContentConfig(
-                temperature=0.1,  # 低温度提高一致性
-                response_mime_type="application/json",
-            )
+            config=self._generate_config,
         )
         
-        # 解析 JSON 响应
-        result_text = response.text.strip()
-        
-        # 尝试解析 JSON
-        try:
-            results = json.loads(result_text)
-            if isinstance(results, list) and len(results) == len(accounts):
-                return results
-            else:
-                return [None] * len(accounts)
-        except json.JSONDecodeError:
-            return [None] * len(accounts)
+        # SDK 已按 schema 解析响应，解析失败时 parsed 为 None
+        records = response.parsed
+        if isinstance(records, list) and len(records) == len(accounts):
+            return records
+        return [None] * len(accounts)
 
 
 # 全局服务实例
@@ -0,0 +1,75 @@
+"""
+本地规则解析模块 - 格式规整的账户直接按规则拆分，无需调用 Gemini API
+"""
+import re
+from typing import Optional
+
+
+# 已知的分销公司（与 Prompt 中列出的保持一致）
+KNOWN_DISTRIBUTORS = {"百川", "星漫", "灵境", "漫谭", "稀谷", "剧点", "中文在线", "风行"}
+
+# 盈利方式只有 iaa 或 iap 两种
+MONETIZATION_TYPES = {"iaa", "iap"}
+
+# 已知的类型（小写比较）；类型位置不是已知类型、或投流人位置是已知类型时说明字段顺序有变化
+KNOWN_TYPES = {"动态漫", "沙雕漫", "沙雕", "推文小说", "漫剧", "ai", "动态2d", "真人ai"}
+
+_DATE_RE = re.compile(r"(0[1-9]|1[0-2])(0[1-9]|[12]\d|3[01])")  # MMDD
+_PRICE_RE = re.compile(r"\d+\.\d+")
+_PINYIN_RE = re.compile(r"[A-Za-z]{1,6}")  # 投流人拼音缩写，如 ztt、mxy、ls
+_CHINESE_NAME_RE = re.compile(r"[\u4e00-\u9fff]{2,3}")  # 投流人中文姓名，如 郑菲雨
+
+
+def try_parse(account: str) -> Optional[dict]:
+    """
+    按标准顺序解析账户：分销自产-上剧日期-盈利方式-名称-投流人-类型[-主体]
+    
+    只处理没有歧义的账户，顺序不符、含价格、名称末尾带数字、名称与投流人
+    无法区分等需要语义判断的情况一律返回 None，交给 Gemini 处理
+    
+    Args:
+        account: 预处理后的账户字符串
+        
+    Returns:
+        与 Gemini 输出字段一致的结果字典，无法确定时返回 None
+    """
+    tokens = [token.strip() for token in account.split("-")]
+    if len(tokens) not in (6, 7) or not all(tokens):
+        return None
+    
+    distributor, date, monetization, name, person, kind = tokens[:6]
+    subject = tokens[6] if len(tokens) == 7 else ""
+    
+    if distributor not in KNOWN_DISTRIBUTORS:
+        return None
+    if not _DATE_RE.fullmatch(date):
+        return None
+    if monetization.lower() not in MONETIZATION_TYPES:
+        return None
+    if any(_PRICE_RE.fullmatch(token) for token in tokens):
+        return None
+    # 名称末尾的数字可能是价格
+    if name[-1].isdigit():
+        return None
+    
+    # 类型和投流人位置必须符合各自的形态，否则可能是字段顺序有变化
+    if kind.lower() not in KNOWN_TYPES or person.lower() in KNOWN_TYPES:
+        return None
+    if _PINYIN_RE.fullmatch(name):
+        return None
+    is_chinese_name = _CHINESE_NAME_RE.fullmatch(person)
+    if not (_PINYIN_RE.fullmatch(person) or is_chinese_name):
+        return None
+    # 名称也只有两三个汉字时无法区分哪个是投流人
+    if is_chinese_name and len(name) <= 3:
+        return None
+    
+    return {
+        "分销自产": distributor,
+        "上剧日期": date,
+        "名称": name,
+        "盈利方式": monetization.lower(),
+        "投流人": person,
+        "类型": kind,
+        "主体": subject,
+    }
@@ -1,8 +1,29 @@
 """
 数据预处理模块
 """
+import math
+import os
 import re
-from typing import List
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional
+
+import pandas as pd
+
+
+# 各种横线变体：一字线、破折号、全角减号等
+SEPARATOR_VARIANTS = [
+    '—',   # 一字线 (U+2014)
+    '–',   # 半角破折号 (U+2013)
+    '―',   # 水平线 (U+2015)
+    '－',  # 全角减号 (U+FF0D)
+    '‐',   # 连字符 (U+2010)
+    '‑',   # 不间断连字符 (U+2011)
+    '⁃',   # 项目符号 (U+2043)
+]
+
+# 一次遍历完成所有横线变体的替换
+_SEP_TABLE = str.maketrans({variant: '-' for variant in SEPARATOR_VARIANTS})
+WS_RE = re.compile(r'\s+')
 
 
 def normalize_separator(text: str) -> str:
@@ -15,27 +36,55 @@ def normalize_separator(text: str) -> str:
     Returns:
         标准化后的字符串
     """
-    # 各种横线变体：一字线、破折号、全角减号等
-    separator_variants = [
-        '—',   # 一字线 (U+2014)
-        '–',   # 半角破折号 (U+2013)
-        '―',   # 水平线 (U+2015)
-        '－',  # 全角减号 (U+FF0D)
-        '‐',   # 连字符 (U+2010)
-        '‑',   # 不间断连字符 (U+2011)
-        '⁃',   # 项目符号 (U+2043)
-    ]
-    
-    result = text
-    for variant in separator_variants:
-        result = result.replace(variant, '-')
+    result = text.translate(_SEP_TABLE)
     
     # 清理多余空格
-    result = re.sub(r'\s+', ' ', result).strip()
+    result = WS_RE.sub(' ', result).strip()
     
     return result
 
 
+def normalize_series(s: pd.Series) -> pd.Series:
+    """
+    整列标准化分隔符，与 normalize_separator 逐条处理的结果一致
+    
+    Args:
+        s: 原始账户字符串列
+        
+    Returns:
+        标准化后的字符串列
+    """
+    return s.str.translate(_SEP_TABLE).str.replace(WS_RE, ' ', regex=True).str.strip()
+
+
+def _normalize_chunk(values: List[str]) -> List[str]:
+    """在子进程中标准化一段账户字符串"""
+    return normalize_series(pd.Series(values, dtype=str)).tolist()
+
+
+def normalize_parallel(s: pd.Series, workers: Optional[int] = None) -> List[str]:
+    """
+    多进程分块标准化，用于超大输入，避免单个进程的预处理成为瓶颈
+    
+    Args:
+        s: 原始账户字符串列
+        workers: 进程数，默认为 CPU 核数
+        
+    Returns:
+        标准化后的字符串列表，顺序与输入一致
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1:
+        # 单核时多进程只会增加序列化开销
+        return normalize_series(s).tolist()
+    
+    values = s.tolist()
+    chunk_size = max(1, math.ceil(len(values) / workers))
+    chunks = [values[i:i + chunk_size] for i in range(0, len(values), chunk_size)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return [value for chunk in pool.map(_normalize_chunk, chunks) for value in chunk]
+
+
 def preprocess_accounts(accounts: List[str]) -> List[str]:
     """
     批量预处理账户字符串